@@ -1,27 +1,126 @@
+"""
+AWS SES -> S3 -> Lambda -> HTTP webhook bridge.
+
+Recommended memory is 1769 MB (the 1 vCPU boundary); set it through the
+lambda_memory_size Terraform variable, which keeps Lambda's 128 MB default.
+Lambda allocates CPU in proportion to memory, and JSON serialization, HMAC
+signing and MIME parsing sit on the critical path, so the shorter duration
+usually outweighs the higher per-ms rate. For latency-sensitive deployments,
+pair this with provisioned concurrency to keep the module-level clients warm.
+"""
+
 import asyncio
-import json
+import atexit
 import logging
+import math
 import os
+import random
+import secrets
+import sys
 import time
-import hashlib
+import weakref
 import hmac
 import fnmatch
-from dataclasses import dataclass, asdict
-from email import message_from_string
-from typing import Dict, Any, List, Optional, Union
-from uuid import uuid4
+import re
+from dataclasses import dataclass, field
+from email.message import Message
+from email.feedparser import BytesFeedParser
+from email.utils import parsedate_to_datetime
+from typing import Dict, Any, FrozenSet, Iterator, List, Optional, Pattern, Tuple, Union
 from datetime import datetime, timezone
 
 import boto3
 import httpx
+from botocore.config import Config as BotoConfig
+from botocore.exceptions import ClientError
+import orjson
 
 
-# Configure structured logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
+# Attributes every LogRecord has; anything else was passed via `extra`
+_RESERVED_LOG_ATTRS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """Format log records as single-line JSON, including `extra` fields"""
+    
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': record.created,
+            'lvl': record.levelname,
+            'msg': record.getMessage()
+        }
+        entry.update(
+            (key, value) for key, value in record.__dict__.items()
+            if key not in _RESERVED_LOG_ATTRS
+        )
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return orjson.dumps(entry, default=str).decode('utf-8')
+
+
+# Configure structured logging; Lambda forwards stdout lines to CloudWatch
+_log_handler = logging.StreamHandler(sys.stdout)
+_log_handler.setFormatter(JsonFormatter())
 logger = logging.getLogger(__name__)
+logger.addHandler(_log_handler)
+logger.setLevel(logging.INFO)
+# The Lambda runtime installs its own root handler; don't emit records twice
+logger.propagate = False
+
+# Full-jitter backoff: wait U(0, min(cap, base * 2**attempt)) between attempts
+BACKOFF_BASE_SECONDS = 0.5
+MAX_BACKOFF_SECONDS = 5.0
+
+# Longest server-provided Retry-After honored; a longer wait would outlast the
+# 60 s function timeout, so the record fails instead of sleeping
+MAX_RETRY_AFTER_SECONDS = MAX_BACKOFF_SECONDS
+
+# Recipient patterns of the form '*@domain' are resolved by a dict lookup
+SUFFIX_PATTERN_RE = re.compile(r'^\*@([a-z0-9.\-]+)$')
+
+# Upper bound on recipient lookups memoized between config loads
+MAX_RESOLVED_EMAILS = 1024
+
+# Response bytes read (and discarded) so a pooled connection can be reused
+MAX_DRAIN_BYTES = 64 * 1024
+
+# Static webhook headers, built once per container
+BASE_HEADERS = {
+    'Content-Type': 'application/json',
+    'User-Agent': 'AWS-SES-Lambda-Bridge/2.0'
+}
+
+
+@dataclass(frozen=True)
+class WildcardSet:
+    """Case-insensitive shell-style wildcards compiled into a single alternation"""
+    patterns: Tuple[str, ...]
+    regex: Pattern[str]
+    
+    @classmethod
+    def compile(cls, patterns: List[str]) -> 'WildcardSet':
+        # Group p<i> wraps patterns[i]; one regex pass replaces a match per pattern
+        alternation = '|'.join(
+            f'(?P<p{i}>{fnmatch.translate(pattern.lower())})' for i, pattern in enumerate(patterns)
+        )
+        return cls(tuple(patterns), re.compile(alternation or '(?!)'))
+    
+    def match(self, value: str) -> Optional[str]:
+        """Return the first pattern matching a lowercased value, or None"""
+        match = self.regex.match(value)
+        return self.patterns[int(match.lastgroup[1:])] if match else None
+
+
+def is_literal_pattern(pattern: str) -> bool:
+    """Check if a pattern has no wildcard characters and so only matches itself"""
+    return not any(c in pattern for c in '*?[')
+
+
+def split_patterns(patterns: List[str]) -> Tuple[FrozenSet[str], WildcardSet]:
+    """Split patterns into lowercased literals for set lookup and the remaining compiled wildcards"""
+    literals = frozenset(p.lower() for p in patterns if is_literal_pattern(p))
+    wildcards = WildcardSet.compile([p for p in patterns if not is_literal_pattern(p)])
+    return literals, wildcards
 
 
 @dataclass
@@ -52,12 +151,44 @@ class DomainConfig:
     payload_format: str = "standard"
     custom_headers: Dict[str, str] = None
     retry_config: Dict[str, Any] = None
+    webhook_secret_bytes: bytes = field(init=False, repr=False)
+    blocked_domains_lower: FrozenSet[str] = field(init=False, repr=False)
+    blocked_senders_literal: FrozenSet[str] = field(init=False, repr=False)
+    blocked_sender_wildcards: WildcardSet = field(init=False, repr=False)
+    # None when every sender is allowed
+    allowed_senders_literal: Optional[FrozenSet[str]] = field(init=False, repr=False)
+    allowed_sender_wildcards: WildcardSet = field(init=False, repr=False)
+    base_headers: Dict[str, str] = field(init=False, repr=False)
+    delivery_key: Tuple[Any, ...] = field(init=False, repr=False)
     
     def __post_init__(self):
         if self.custom_headers is None:
             self.custom_headers = {}
         if self.retry_config is None:
             self.retry_config = {}
+        # Static and custom webhook headers, merged once per config
+        self.base_headers = {**BASE_HEADERS, **self.custom_headers}
+        # Encode the signing key once instead of on every delivery
+        self.webhook_secret_bytes = self.webhook_secret.encode('utf-8') if self.webhook_secret else b''
+        # Everything send_webhook reads; records whose configs share it can be batched together
+        self.delivery_key = (
+            self.webhook_url,
+            self.webhook_secret,
+            tuple(sorted(self.base_headers.items())),
+            self.retry_config.get('max_retries', 3),
+            self.retry_config.get('timeout_seconds', 30)
+        )
+        # Sender filters are compiled once per config rather than per email
+        filters = self.filters
+        self.blocked_domains_lower = frozenset(d.lower() for d in filters.get('blocked_domains', []))
+        self.blocked_senders_literal, self.blocked_sender_wildcards = split_patterns(
+            filters.get('blocked_senders', [])
+        )
+        allowed_senders = filters.get('allowed_senders', ['*'])
+        if allowed_senders == ['*']:
+            self.allowed_senders_literal, self.allowed_sender_wildcards = None, WildcardSet.compile([])
+        else:
+            self.allowed_senders_literal, self.allowed_sender_wildcards = split_patterns(allowed_senders)
 
 
 @dataclass
@@ -68,7 +199,36 @@ class WebhookPayload:
     content: EmailContent
     
     def to_dict(self) -> Dict[str, Any]:
-        return asdict(self)
+        # Built by hand: asdict() introspects fields and deep-copies every value.
+        # Keys are listed alphabetically to keep the historical sorted layout.
+        metadata = self.metadata
+        return {
+            'content': {
+                'html': self.content.html,
+                'text': self.content.text
+            },
+            'event_type': self.event_type,
+            'metadata': {
+                'correlation_id': metadata.correlation_id,
+                'from_address': metadata.from_address,
+                'message_id': metadata.message_id,
+                'subject': metadata.subject,
+                'timestamp': metadata.timestamp,
+                'to_addresses': metadata.to_addresses
+            }
+        }
+
+
+@dataclass
+class WebhookBatchPayload:
+    """Several email events delivered to one webhook in a single request"""
+    events: List[WebhookPayload]
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'event_type': 'email_batch',
+            'events': [event.to_dict() for event in self.events]
+        }
 
 
 class EmailProcessingError(Exception):
@@ -84,14 +244,22 @@ class WebhookDeliveryError(Exception):
 class DomainConfigManager:
     """Manages domain configurations with caching and S3 integration"""
     
-    def __init__(self, s3_bucket: str, config_key: str = "config/domains.json"):
+    def __init__(self, s3_bucket: str, config_key: str = "config/domains.json", s3_client=None):
         self.s3_bucket = s3_bucket
         self.config_key = config_key
-        self.s3_client = boto3.client('s3')
+        self.s3_client = s3_client or boto3.client('s3')
         self._config_cache = None
         self._cache_timestamp = None
         self._cache_ttl = 300  # 5 minutes
+        self._config_etag: Optional[str] = None
         self._global_settings = {}
+        # Exact addresses and '*@domain' patterns keyed by address/domain: (domain order, domain name, pattern)
+        self._literal_index: Dict[str, Tuple[int, str, str]] = {}
+        self._suffix_index: Dict[str, Tuple[int, str, str]] = {}
+        # Every other recipient pattern, one compiled set per domain in config order
+        self._wildcard_patterns: List[Tuple[int, str, WildcardSet]] = []
+        # Lowercased recipient -> resolved domain config, reset on every config load
+        self._resolved_emails: Dict[str, Optional[DomainConfig]] = {}
         
     def _is_cache_valid(self) -> bool:
         """Check if cached configuration is still valid"""
@@ -101,23 +269,37 @@ class DomainConfigManager:
         cache_age = time.time() - self._cache_timestamp
         return cache_age < self._cache_ttl
     
-    async def _load_config_from_s3(self) -> Dict[str, Any]:
-        """Load configuration from S3"""
+    async def _load_config_from_s3(self) -> Optional[Dict[str, Any]]:
+        """Load configuration from S3; None means the cached copy is still current"""
+        request = {'Bucket': self.s3_bucket, 'Key': self.config_key}
+        if self._config_etag and self._config_cache is not None:
+            # S3 answers 304 with no body while the object is unchanged
+            request['IfNoneMatch'] = self._config_etag
+        
         try:
-            logger.info(f"Loading domain config from S3: s3://{self.s3_bucket}/{self.config_key}")
+            logger.info("Loading domain config from S3: s3://%s/%s", self.s3_bucket, self.config_key)
             
-            response = self.s3_client.get_object(Bucket=self.s3_bucket, Key=self.config_key)
-            config_content = response['Body'].read().decode('utf-8')
-            config_data = json.loads(config_content)
+            # boto3 is blocking; keep the event loop free for in-flight records
+            response = await asyncio.to_thread(self.s3_client.get_object, **request)
+            config_data = orjson.loads(await asyncio.to_thread(response['Body'].read))
+            self._config_etag = response.get('ETag')
             
-            logger.info(f"Loaded configuration for {len(config_data.get('domains', {}))} domains")
+            logger.info("Loaded configuration for %s domains", len(config_data.get('domains', {})))
             return config_data
             
-        except self.s3_client.exceptions.NoSuchKey:
-            logger.warning(f"No configuration found at s3://{self.s3_bucket}/{self.config_key}")
+        except ClientError as e:
+            error_code = e.response.get('Error', {}).get('Code')
+            if error_code in ('304', 'NotModified'):
+                logger.info("Domain config unchanged since last load")
+                return None
+            if error_code == 'NoSuchKey':
+                logger.warning("No configuration found at s3://%s/%s", self.s3_bucket, self.config_key)
+                self._config_etag = None
+            else:
+                logger.error("Failed to load config from S3: %s", e)
             return {"domains": {}, "global_settings": {}}
         except Exception as e:
-            logger.error(f"Failed to load config from S3: {str(e)}")
+            logger.error("Failed to load config from S3: %s", e)
             return {"domains": {}, "global_settings": {}}
     
     async def _load_config_from_env(self) -> Dict[str, Any]:
@@ -161,57 +343,107 @@ class DomainConfigManager:
         if self._is_cache_valid():
             return self._config_cache
         
-        # Try to load from S3 first
-        config = await self._load_config_from_s3()
+        # Records processed concurrently share a single reload
+        async with loop_semaphore('domain_config', 1):
+            if self._is_cache_valid():
+                return self._config_cache
+            
+            # Try to load from S3 first
+            config = await self._load_config_from_s3()
+            if config is None:
+                # Unchanged; keep the parsed config and precompiled patterns
+                self._cache_timestamp = time.time()
+                return self._config_cache
+            
+            # If S3 config is empty, try environment variables
+            if not config.get('domains'):
+                config = await self._load_config_from_env()
+            
+            # Cache the configuration
+            self._config_cache = config
+            self._cache_timestamp = time.time()
+            self._global_settings = config.get('global_settings', {})
+            self._precompile_patterns(config)
+            self._resolved_emails = {}
+        
+        return config
+    
+    def _precompile_patterns(self, config: Dict[str, Any]) -> None:
+        """Compile every recipient pattern once per config load"""
+        self._literal_index = {}
+        self._suffix_index = {}
+        self._wildcard_patterns = []
         
-        # If S3 config is empty, try environment variables
-        if not config.get('domains'):
-            config = await self._load_config_from_env()
+        for position, (domain_name, domain_config) in enumerate(config.get('domains', {}).items()):
+            wildcards = []
+            for pattern in domain_config.get('patterns', []):
+                # An earlier domain keeps precedence for a duplicated address or suffix
+                normalized = pattern.lower()
+                suffix_match = SUFFIX_PATTERN_RE.match(normalized)
+                if suffix_match:
+                    self._suffix_index.setdefault(suffix_match.group(1), (position, domain_name, pattern))
+                elif is_literal_pattern(normalized):
+                    self._literal_index.setdefault(normalized, (position, domain_name, pattern))
+                else:
+                    wildcards.append(pattern)
+            if wildcards:
+                self._wildcard_patterns.append((position, domain_name, WildcardSet.compile(wildcards)))
+    
+    def _find_matching_domain(self, email: str) -> Optional[Tuple[str, str]]:
+        """Return (domain name, pattern) of the first configured domain matching a lowercased email"""
+        _, at, email_domain = email.rpartition('@')
+        suffix_hit = self._suffix_index.get(email_domain) if at else None
+        literal_hit = self._literal_index.get(email)
+        index_hit = min(filter(None, (literal_hit, suffix_hit)), default=None)
         
-        # Cache the configuration
-        self._config_cache = config
-        self._cache_timestamp = time.time()
-        self._global_settings = config.get('global_settings', {})
+        # Wildcards from domains listed before the indexed hit still take precedence
+        for position, domain_name, wildcards in self._wildcard_patterns:
+            if index_hit and position >= index_hit[0]:
+                break
+            pattern = wildcards.match(email)
+            if pattern is not None:
+                return domain_name, pattern
         
-        return config
+        if index_hit:
+            return index_hit[1], index_hit[2]
+        return None
     
     async def get_domain_config_for_email(self, email: str) -> Optional[DomainConfig]:
         """Get domain configuration for a specific email address"""
         config = await self.get_config()
-        domains = config.get('domains', {})
+        email_key = email.lower()
+        if email_key in self._resolved_emails:
+            return self._resolved_emails[email_key]
         
-        # Find matching domain configuration
-        for domain_name, domain_config in domains.items():
-            patterns = domain_config.get('patterns', [])
+        domain_config = self._resolve_domain_config(email, email_key, config.get('domains', {}))
+        if len(self._resolved_emails) >= MAX_RESOLVED_EMAILS:
+            self._resolved_emails.clear()
+        self._resolved_emails[email_key] = domain_config
+        return domain_config
+    
+    def _resolve_domain_config(self, email: str, email_key: str, domains: Dict[str, Any]) -> Optional[DomainConfig]:
+        """Build the domain configuration for the first domain matching a lowercased email"""
+        match = self._find_matching_domain(email_key)
+        if match:
+            domain_name, pattern = match
+            logger.info("Email %s matches pattern %s for domain %s", email, pattern, domain_name)
             
-            for pattern in patterns:
-                if self._matches_pattern(email.lower(), pattern.lower()):
-                    logger.info(f"Email {email} matches pattern {pattern} for domain {domain_name}")
-                    
-                    # Merge with global settings
-                    merged_config = self._merge_with_global_settings(domain_config)
-                    
-                    return DomainConfig(
-                        webhook_url=merged_config['webhook_url'],
-                        webhook_secret=merged_config.get('webhook_secret', ''),
-                        patterns=merged_config['patterns'],
-                        filters=merged_config.get('filters', {}),
-                        payload_format=merged_config.get('payload_format', 'standard'),
-                        custom_headers=merged_config.get('custom_headers', {}),
-                        retry_config=merged_config.get('retry_config', {})
-                    )
+            # Merge with global settings
+            merged_config = self._merge_with_global_settings(domains[domain_name])
+            
+            return DomainConfig(
+                webhook_url=merged_config['webhook_url'],
+                webhook_secret=merged_config.get('webhook_secret', ''),
+                patterns=merged_config['patterns'],
+                filters=merged_config.get('filters', {}),
+                payload_format=merged_config.get('payload_format', 'standard'),
+                custom_headers=merged_config.get('custom_headers', {}),
+                retry_config=merged_config.get('retry_config', {})
+            )
         
-        logger.info(f"No domain configuration found for email: {email}")
+        logger.info("No domain configuration found for email: %s", email)
         return None
     
-    def _matches_pattern(self, email: str, pattern: str) -> bool:
-        """Check if email matches a pattern (supports wildcards)"""
-        try:
-            return fnmatch.fnmatch(email, pattern)
-        except Exception as e:
-            logger.warning(f"Pattern matching failed for {email} against {pattern}: {str(e)}")
-            return False
-    
     def _merge_with_global_settings(self, domain_config: Dict[str, Any]) -> Dict[str, Any]:
         """Merge domain config with global settings"""
         merged = domain_config.copy()
@@ -238,50 +470,47 @@ class DomainConfigManager:
     
     async def is_email_allowed(self, metadata: EmailMetadata) -> Optional[DomainConfig]:
         """Check if email is allowed and return matching domain config"""
-        for email_addr in metadata.to_addresses:
+        return await self.find_domain_config(metadata.from_address, metadata.to_addresses)
+    
+    async def find_domain_config(self, from_address: str, to_addresses: List[str]) -> Optional[DomainConfig]:
+        """Return the first domain config matching a recipient whose filters the sender passes"""
+        # Normalized once per email rather than for every candidate recipient
+        sender = from_address.lower()
+        for email_addr in to_addresses:
             domain_config = await self.get_domain_config_for_email(email_addr)
             if domain_config:
                 # Apply filters
-                if self._passes_filters(metadata, domain_config):
+                if self._passes_filters(sender, domain_config):
                     return domain_config
                 else:
-                    logger.warning(f"Email {email_addr} matches domain but fails filters")
+                    logger.warning("Email %s matches domain but fails filters", email_addr)
         
         return None
     
-    def _passes_filters(self, metadata: EmailMetadata, config: DomainConfig) -> bool:
-        """Check if email passes domain-specific filters"""
-        filters = config.filters
+    def _passes_filters(self, sender: str, config: DomainConfig) -> bool:
+        """Check if a lowercased sender passes domain-specific filters"""
+        _, at, sender_domain = sender.rpartition('@')
+        if not at:
+            sender_domain = ''
         
-        # Check sender filters
-        allowed_senders = filters.get('allowed_senders', ['*'])
-        blocked_senders = filters.get('blocked_senders', [])
-        blocked_domains = filters.get('blocked_domains', [])
-        
-        sender = metadata.from_address.lower()
-        sender_domain = sender.split('@')[-1] if '@' in sender else ''
-        
-        # Check blocked senders first
-        for blocked_pattern in blocked_senders:
-            if self._matches_pattern(sender, blocked_pattern.lower()):
-                logger.info(f"Sender {sender} blocked by pattern {blocked_pattern}")
-                return False
+        # Check blocked domains first; a set lookup is cheaper than any pattern
+        if sender_domain in config.blocked_domains_lower:
+            logger.info("Sender domain %s is blocked", sender_domain)
+            return False
         
-        # Check blocked domains
-        if sender_domain in [d.lower() for d in blocked_domains]:
-            logger.info(f"Sender domain {sender_domain} is blocked")
+        # Check blocked senders
+        if sender in config.blocked_senders_literal:
+            logger.info("Sender %s blocked by pattern %s", sender, sender)
+            return False
+        blocked_pattern = config.blocked_sender_wildcards.match(sender)
+        if blocked_pattern is not None:
+            logger.info("Sender %s blocked by pattern %s", sender, blocked_pattern)
             return False
         
         # Check allowed senders (if not wildcard)
-        if allowed_senders != ['*']:
-            sender_allowed = False
-            for allowed_pattern in allowed_senders:
-                if self._matches_pattern(sender, allowed_pattern.lower()):
-                    sender_allowed = True
-                    break
-            
-            if not sender_allowed:
-                logger.info(f"Sender {sender} not in allowed list")
+        if config.allowed_senders_literal is not None and sender not in config.allowed_senders_literal:
+            if config.allowed_sender_wildcards.match(sender) is None:
+                logger.info("Sender %s not in allowed list", sender)
                 return False
         
         return True
@@ -298,14 +527,24 @@ class Config:
         self.max_retries = int(os.environ.get('MAX_RETRIES', '3'))
         self.timeout_seconds = int(os.environ.get('TIMEOUT_SECONDS', '30'))
         self.max_email_size_mb = int(os.environ.get('MAX_EMAIL_SIZE_MB', '10'))
+        # S3 downloads larger than the threshold are split into parallel byte-range GETs
+        self.multipart_threshold_bytes = int(os.environ.get('MULTIPART_THRESHOLD_BYTES', str(1024 * 1024)))
+        self.multipart_chunk_bytes = int(os.environ.get('MULTIPART_CHUNK_BYTES', str(1024 * 1024)))
+        # Caps on in-flight requests when a batch of records is processed concurrently
+        self.max_concurrent_webhooks = int(os.environ.get('MAX_CONCURRENT_WEBHOOKS', '5'))
+        self.max_concurrent_s3_reads = int(os.environ.get('MAX_CONCURRENT_S3_READS', '10'))
+        # Header-only receivers can skip the S3 download and MIME parse entirely
+        self.include_email_body = os.environ.get('WEBHOOK_INCLUDE_BODY', 'true').lower() == 'true'
+        # Opt-in: records for the same webhook are sent as one 'email_batch' request
+        self.batch_webhooks = os.environ.get('BATCH_WEBHOOKS', 'false').lower() == 'true'
         
         self._validate()
     
-    def _parse_domains(self, domains_str: str) -> List[str]:
-        """Parse comma-separated domains"""
+    def _parse_domains(self, domains_str: str) -> FrozenSet[str]:
+        """Parse comma-separated domains into a set for O(1) membership checks"""
         if not domains_str:
-            return []
-        return [domain.strip().lower() for domain in domains_str.split(',') if domain.strip()]
+            return frozenset()
+        return frozenset(domain.strip().lower() for domain in domains_str.split(',') if domain.strip())
     
     def _validate(self):
         """Validate required configuration"""
@@ -313,11 +552,60 @@ class Config:
             raise ValueError("TARGET_WEBHOOK_URL is required")
         if not self.s3_bucket:
             raise ValueError("S3_BUCKET is required")
+        if self.multipart_threshold_bytes <= 0 or self.multipart_chunk_bytes <= 0:
+            raise ValueError("MULTIPART_THRESHOLD_BYTES and MULTIPART_CHUNK_BYTES must be positive")
+        if self.max_concurrent_webhooks <= 0 or self.max_concurrent_s3_reads <= 0:
+            raise ValueError("MAX_CONCURRENT_WEBHOOKS and MAX_CONCURRENT_S3_READS must be positive")
 
 
-# Initialize configuration and AWS client
+# Initialize configuration and AWS client. One client is shared by email
+# reads and the domain config manager; building a client loads the whole
+# S3 service model, so a second one costs cold-start time and memory.
 config = Config()
-s3_client = boto3.client('s3')
+s3_client = boto3.client(
+    's3',
+    config=BotoConfig(
+        max_pool_connections=config.max_concurrent_s3_reads,
+        tcp_keepalive=True,
+        retries={'max_attempts': 2, 'mode': 'standard'}
+    )
+)
+
+# Shared HTTP client so pooled TCP/TLS connections are reused across
+# webhook attempts and warm invocations. HTTP/2 is negotiated over TLS where
+# the endpoint supports it, multiplexing concurrent deliveries on one connection.
+http_client = httpx.AsyncClient(
+    http2=True,
+    timeout=config.timeout_seconds,
+    limits=httpx.Limits(max_keepalive_connections=20, max_connections=20)
+)
+
+# Persistent event loop; pooled connections are bound to the loop that opened them
+event_loop = asyncio.new_event_loop()
+
+
+def _close_http_client() -> None:
+    """Close pooled HTTP connections on runtime shutdown"""
+    if not event_loop.is_closed():
+        event_loop.run_until_complete(http_client.aclose())
+        event_loop.close()
+
+
+atexit.register(_close_http_client)
+
+# Semaphores bind to the event loop they are first used on, so keep one set per loop
+_loop_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Semaphore]]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def loop_semaphore(name: str, limit: int) -> asyncio.Semaphore:
+    """Return the named concurrency limit shared by all tasks on the running loop"""
+    semaphores = _loop_semaphores.setdefault(asyncio.get_running_loop(), {})
+    if name not in semaphores:
+        semaphores[name] = asyncio.Semaphore(limit)
+    return semaphores[name]
+
 
 # Initialize domain configuration manager
 domain_config_manager = None
@@ -327,7 +615,7 @@ def lambda_handler(event: Dict[str, Any], context) -> Dict[str, Any]:
     """
     Main Lambda handler for processing SES emails
     """
-    correlation_id = str(uuid4())
+    correlation_id = secrets.token_hex(16)
     
     # Initialize domain config manager if not already done
     global domain_config_manager
@@ -335,21 +623,58 @@ def lambda_handler(event: Dict[str, Any], context) -> Dict[str, Any]:
         # Use config bucket if dynamic config is enabled, otherwise use email bucket
         config_bucket = os.environ.get('CONFIG_S3_BUCKET', config.s3_bucket)
         config_key = os.environ.get('CONFIG_S3_KEY', 'config/domains.json')
-        domain_config_manager = DomainConfigManager(config_bucket, config_key)
+        domain_config_manager = DomainConfigManager(config_bucket, config_key, s3_client=s3_client)
     
     logger.info(
         "Processing SES event",
         extra={
             "correlation_id": correlation_id,
-            "event_records_count": len(event.get('Records', []))
+            "event_records_count": len(event.get('Records', [])),
+            # Recorded for power-tuning runs that compare memory sizes
+            "memory_limit_mb": getattr(context, 'memory_limit_in_mb', None)
         }
     )
     
     try:
-        # Process SES records
-        for record in event.get('Records', []):
-            if record.get('eventSource') == 'aws:ses':
-                asyncio.run(process_ses_email(record['ses'], correlation_id))
+        # Process SES records concurrently on the shared event loop
+        ses_records = [
+            record['ses'] for record in event.get('Records', [])
+            if record.get('eventSource') == 'aws:ses'
+        ]
+        results = event_loop.run_until_complete(process_ses_records(ses_records, correlation_id))
+        
+        failed_message_ids = []
+        for ses_data, result in zip(ses_records, results):
+            # BaseException so a cancelled record is reported rather than counted as a success
+            if isinstance(result, BaseException):
+                message_id = ses_data.get('mail', {}).get('messageId', 'unknown')
+                failed_message_ids.append(message_id)
+                logger.error(
+                    "Record %s failed: %s", message_id, result,
+                    extra={
+                        "correlation_id": correlation_id,
+                        "message_id": message_id,
+                        "error_type": type(result).__name__
+                    }
+                )
+        
+        if failed_message_ids:
+            logger.error(
+                "Failed to process %s of %s emails", len(failed_message_ids), len(ses_records),
+                extra={
+                    "correlation_id": correlation_id,
+                    "failed_message_ids": failed_message_ids
+                }
+            )
+            # 207 lets callers distinguish a partially failed batch from a total failure
+            return {
+                'statusCode': 500 if len(failed_message_ids) == len(ses_records) else 207,
+                'body': orjson.dumps({
+                    'error': f"Failed to process {len(failed_message_ids)} of {len(ses_records)} emails",
+                    'failed_message_ids': failed_message_ids,
+                    'correlation_id': correlation_id
+                }).decode('utf-8')
+            }
         
         logger.info(
             "Email processing completed successfully",
@@ -358,15 +683,15 @@ def lambda_handler(event: Dict[str, Any], context) -> Dict[str, Any]:
         
         return {
             'statusCode': 200,
-            'body': json.dumps({
+            'body': orjson.dumps({
                 'message': 'Email processed successfully',
                 'correlation_id': correlation_id
-            })
+            }).decode('utf-8')
         }
         
     except Exception as e:
         logger.error(
-            f"Error processing email: {str(e)}",
+            "Error processing email: %s", e,
             extra={
                 "correlation_id": correlation_id,
                 "error_type": type(e).__name__
@@ -374,44 +699,117 @@ def lambda_handler(event: Dict[str, Any], context) -> Dict[str, Any]:
         )
         return {
             'statusCode': 500,
-            'body': json.dumps({
+            'body': orjson.dumps({
                 'error': str(e),
                 'correlation_id': correlation_id
-            })
+            }).decode('utf-8')
         }
 
 
+async def process_ses_records(ses_records: List[Dict[str, Any]], correlation_id: str) -> List[Any]:
+    """Process SES records concurrently, returning each record's result or exception"""
+    if not config.batch_webhooks:
+        return await asyncio.gather(
+            *(process_ses_email(ses_data, correlation_id) for ses_data in ses_records),
+            return_exceptions=True
+        )
+    
+    results = await asyncio.gather(
+        *(prepare_ses_email(ses_data, correlation_id) for ses_data in ses_records),
+        return_exceptions=True
+    )
+    
+    # Group deliverable records by delivery key; configs in a group agree on
+    # endpoint, secret, headers and retry policy, so any of them can send the batch
+    batches: Dict[Tuple[Any, ...], List[int]] = {}
+    for index, result in enumerate(results):
+        if isinstance(result, tuple):
+            batches.setdefault(result[1].delivery_key, []).append(index)
+    
+    deliveries = await asyncio.gather(
+        *(deliver_ses_batch([results[index] for index in indices], correlation_id) for indices in batches.values()),
+        return_exceptions=True
+    )
+    
+    for indices, delivery in zip(batches.values(), deliveries):
+        for index in indices:
+            results[index] = delivery
+    return results
+
+
+async def deliver_ses_batch(prepared: List[Tuple[WebhookPayload, DomainConfig]], correlation_id: str) -> None:
+    """Deliver prepared records for one webhook, batching only when there is more than one"""
+    payloads = [payload for payload, _ in prepared]
+    domain_config = prepared[0][1]
+    
+    try:
+        if len(payloads) == 1:
+            await send_webhook(payloads[0], domain_config, correlation_id)
+        else:
+            logger.info(
+                "Sending %s emails to %s in one batch", len(payloads), domain_config.webhook_url,
+                extra={"correlation_id": correlation_id}
+            )
+            await send_webhook(WebhookBatchPayload(events=payloads), domain_config, correlation_id)
+    except Exception as e:
+        logger.error(
+            "Failed to deliver %s email(s): %s", len(payloads), e,
+            extra={
+                "correlation_id": correlation_id,
+                "error_type": type(e).__name__
+            }
+        )
+        raise EmailProcessingError(f"Failed to process email: {str(e)}")
+
+
 async def process_ses_email(ses_data: Dict[str, Any], correlation_id: str) -> None:
     """Process a single SES email record"""
+    prepared = await prepare_ses_email(ses_data, correlation_id)
+    if prepared:
+        await deliver_ses_batch([prepared], correlation_id)
+
+
+async def prepare_ses_email(ses_data: Dict[str, Any], correlation_id: str) -> Optional[Tuple[WebhookPayload, DomainConfig]]:
+    """Route an SES email record and build its webhook payload; None when it is not delivered"""
     
     try:
-        # Extract metadata
-        metadata = extract_email_metadata(ses_data, correlation_id)
+        mail = ses_data['mail']
         
         logger.info(
-            f"Processing email from {metadata.from_address} to {metadata.to_addresses}",
+            "Processing email from %s to %s", mail['source'], mail['destination'],
             extra={"correlation_id": correlation_id}
         )
         
-        # Get domain configuration for this email
-        domain_config = await domain_config_manager.is_email_allowed(metadata)
+        # Route on the raw SES addresses so rejected mail skips all further work
+        domain_config = await domain_config_manager.find_domain_config(mail['source'], mail['destination'])
         if not domain_config:
             logger.warning(
-                f"Email not allowed or no matching domain config: from {metadata.from_address} to {metadata.to_addresses}",
+                "Email not allowed or no matching domain config: from %s to %s",
+                mail['source'],
+                mail['destination'],
                 extra={"correlation_id": correlation_id}
             )
-            return
+            return None
+        
+        # Extract metadata
+        metadata = extract_email_metadata(ses_data, correlation_id)
         
         logger.info(
-            f"Using domain config - webhook: {domain_config.webhook_url}, format: {domain_config.payload_format}",
+            "Using domain config - webhook: %s, format: %s",
+            domain_config.webhook_url,
+            domain_config.payload_format,
             extra={"correlation_id": correlation_id}
         )
         
-        # Check email size against domain limits
-        max_size_mb = domain_config.filters.get('max_size_mb', 10)
-        
-        # Get email content from S3
-        email_content = await get_email_content(ses_data, correlation_id, max_size_mb)
+        if config.include_email_body:
+            # Check email size against domain limits
+            max_size_mb = domain_config.filters.get('max_size_mb', 10)
+            
+            # Get email content from S3
+            email_content = await get_email_content(ses_data, correlation_id, max_size_mb)
+        else:
+            # Metadata comes from the SES notification, so the stored email is never read
+            email_content = EmailContent(text="", html="")
         
         # Create webhook payload
         payload = WebhookPayload(
@@ -419,13 +817,11 @@ async def process_ses_email(ses_data: Dict[str, Any], correlation_id: str) -> No
             metadata=metadata,
             content=email_content
         )
-        
-        # Send to webhook with domain-specific configuration
-        await send_webhook(payload, domain_config, correlation_id)
+        return payload, domain_config
         
     except Exception as e:
         logger.error(
-            f"Failed to process email: {str(e)}",
+            "Failed to process email: %s", e,
             extra={
                 "correlation_id": correlation_id,
                 "error_type": type(e).__name__
@@ -454,93 +850,103 @@ def extract_email_metadata(ses_data: Dict[str, Any], correlation_id: str) -> Ema
 def is_email_allowed(metadata: EmailMetadata) -> bool:
     """Check if email is from/to allowed domains (DEPRECATED)"""
     
-    if not config.allowed_domains:
+    allowed_domains = config.allowed_domains
+    if not allowed_domains:
         return True
     
     # Check if any destination domain is allowed
     for email_addr in metadata.to_addresses:
-        domain = email_addr.split('@')[-1].lower()
-        if domain in config.allowed_domains:
+        domain = email_addr.rpartition('@')[2].lower()
+        if domain in allowed_domains:
             return True
     
     return False
 
 
+def resolve_s3_location(ses_data: Dict[str, Any]) -> Tuple[str, str]:
+    """Return the (bucket, key) of the stored email from the SES receipt"""
+    # SES receipt action can be a dict (most common case) or a list
+    action_data = ses_data['receipt'].get('action', {})
+    actions = action_data if isinstance(action_data, list) else [action_data]
+    s3_action = next((action for action in actions if action.get('type') == 's3'), None)
+    
+    if s3_action:
+        return s3_action['bucketName'], s3_action['objectKey']
+    
+    # No S3 action in the receipt; fall back to the configured bucket and message ID
+    return config.s3_bucket, f"emails/{ses_data['mail']['messageId']}"
+
+
 async def get_email_content(ses_data: Dict[str, Any], correlation_id: str, max_size_mb: int = 10) -> EmailContent:
     """Retrieve and parse email content from S3"""
     
     try:
-        # Find S3 action in receipt
-        receipt = ses_data['receipt']
-        s3_action = None
-        
-        # SES receipt action can be a dict or list
-        action_data = receipt.get('action', {})
-        if isinstance(action_data, dict):
-            # Single action (most common case)
-            if action_data.get('type') == 's3':
-                s3_action = action_data
-        elif isinstance(action_data, list):
-            # Multiple actions
-            for action in action_data:
-                if action.get('type') == 's3':
-                    s3_action = action
-                    break
+        bucket, key = resolve_s3_location(ses_data)
         
-        # If no S3 action found in receipt, construct from environment and message ID
-        if not s3_action:
-            logger.info(
-                "No S3 action found in receipt, constructing from environment",
-                extra={"correlation_id": correlation_id}
+        logger.info(
+            "Retrieving email from S3: s3://%s/%s", bucket, key,
+            extra={"correlation_id": correlation_id}
+        )
+        
+        # The first ranged GET reports the object size and, for most emails,
+        # already holds the whole body. boto3 is blocking, so it runs in a
+        # worker thread to let concurrent records overlap.
+        async with loop_semaphore('s3', config.max_concurrent_s3_reads):
+            response = await asyncio.to_thread(
+                s3_client.get_object,
+                Bucket=bucket,
+                Key=key,
+                Range=f"bytes=0-{config.multipart_threshold_bytes - 1}"
             )
             
-            # Get S3 bucket from environment
-            bucket = os.environ.get('S3_BUCKET')
-            if not bucket:
-                logger.error(
-                    "S3_BUCKET environment variable not set",
+            # Check file size using domain-specific limit
+            content_range = response.get('ContentRange')
+            if content_range:
+                content_length = int(content_range.rsplit('/', 1)[-1])
+            else:
+                content_length = response.get('ContentLength', 0)
+            max_size_bytes = max_size_mb * 1024 * 1024
+            
+            if content_length > max_size_bytes:
+                response['Body'].close()
+                logger.warning(
+                    "Email size %s bytes exceeds domain limit %s bytes (%sMB)",
+                    content_length,
+                    max_size_bytes,
+                    max_size_mb,
                     extra={"correlation_id": correlation_id}
                 )
-                return EmailContent(text="", html="")
-            
-            # Construct S3 key from message ID
-            message_id = ses_data['mail']['messageId']
-            key = f"emails/{message_id}"
+                return EmailContent(text="Email too large to process", html="")
             
-            logger.info(
-                f"Constructed S3 path: s3://{bucket}/{key}",
-                extra={"correlation_id": correlation_id}
-            )
-        else:
-            # Retrieve email from S3 action
-            bucket = s3_action['bucketName']
-            key = s3_action['objectKey']
-        
-        logger.info(
-            f"Retrieving email from S3: s3://{bucket}/{key}",
-            extra={"correlation_id": correlation_id}
-        )
-        
-        response = s3_client.get_object(Bucket=bucket, Key=key)
+            first_part = await asyncio.to_thread(response['Body'].read)
         
-        # Check file size using domain-specific limit
-        content_length = response.get('ContentLength', 0)
-        max_size_bytes = max_size_mb * 1024 * 1024
+        # Ranges are fed to the parser in order rather than joined first,
+        # so a large email is never held as one extra contiguous copy.
+        # The default compat32 policy avoids importing email.policy at all.
+        parser = BytesFeedParser()
+        parser.feed(first_part)
         
-        if content_length > max_size_bytes:
-            logger.warning(
-                f"Email size {content_length} bytes exceeds domain limit {max_size_bytes} bytes ({max_size_mb}MB)",
+        # Fetch the rest of a large email as parallel byte ranges
+        if content_length > len(first_part):
+            chunk_size = config.multipart_chunk_bytes
+            remaining_parts = await asyncio.gather(*(
+                read_s3_range(bucket, key, start, min(start + chunk_size, content_length) - 1)
+                for start in range(len(first_part), content_length, chunk_size)
+            ))
+            logger.info(
+                "Downloaded %s bytes in %s ranged GETs", content_length, len(remaining_parts) + 1,
                 extra={"correlation_id": correlation_id}
             )
-            return EmailContent(text="Email too large to process", html="")
+            for part in remaining_parts:
+                parser.feed(part)
         
-        # Parse email content
-        raw_email = response['Body'].read().decode('utf-8', errors='ignore')
-        return parse_email_content(raw_email, correlation_id)
+        # Each MIME part is decoded later with its own charset
+        msg = parser.close()
+        return parse_email_message(msg, correlation_id)
         
     except Exception as e:
         logger.error(
-            f"Failed to get email content: {str(e)}",
+            "Failed to get email content: %s", e,
             extra={
                 "correlation_id": correlation_id,
                 "error_type": type(e).__name__
@@ -549,48 +955,92 @@ async def get_email_content(ses_data: Dict[str, Any], correlation_id: str, max_s
         return EmailContent(text="", html="")
 
 
-def parse_email_content(raw_email: str, correlation_id: str) -> EmailContent:
-    """Parse email content to extract text and HTML body"""
+async def read_s3_range(bucket: str, key: str, start: int, end: int) -> bytes:
+    """Read an inclusive byte range of an S3 object"""
+    async with loop_semaphore('s3', config.max_concurrent_s3_reads):
+        response = await asyncio.to_thread(
+            s3_client.get_object,
+            Bucket=bucket,
+            Key=key,
+            Range=f"bytes={start}-{end}"
+        )
+        return await asyncio.to_thread(response['Body'].read)
+
+
+def decode_part_payload(part: Message, payload: bytes) -> str:
+    """Decode a MIME part payload using its declared charset"""
+    charset = part.get_content_charset() or 'utf-8'
+    try:
+        return payload.decode(charset, errors='ignore')
+    except LookupError:
+        # Unknown charset name in the email headers
+        return payload.decode('utf-8', errors='ignore')
+
+
+def iter_body_parts(msg: Message) -> Iterator[Message]:
+    """Yield leaf MIME parts in order, skipping attachments and their subtrees"""
+    for part in msg.get_payload():
+        # Don't descend into attachments such as forwarded messages
+        # (RFC 2183: the disposition type comes first and is case-insensitive)
+        if part.get('Content-Disposition', '').lower().startswith('attachment'):
+            continue
+        
+        if part.is_multipart():
+            yield from iter_body_parts(part)
+        else:
+            yield part
+
+
+def parse_email_message(msg: Message, correlation_id: str) -> EmailContent:
+    """Extract text and HTML body from a parsed email message"""
     
     try:
-        msg = message_from_string(raw_email)
         text_content = ""
         html_content = ""
         
         if msg.is_multipart():
-            # Handle multipart messages
-            for part in msg.walk():
+            # Handle multipart messages; the first text and HTML bodies win
+            for part in iter_body_parts(msg):
                 content_type = part.get_content_type()
-                content_disposition = part.get('Content-Disposition', '')
                 
-                # Skip attachments
-                if 'attachment' in content_disposition:
+                # Only decode body types we still need
+                if content_type == 'text/plain':
+                    if text_content:
+                        continue
+                elif content_type == 'text/html':
+                    if html_content:
+                        continue
+                else:
                     continue
                 
                 payload = part.get_payload(decode=True)
                 if not payload:
                     continue
                 
-                content = payload.decode('utf-8', errors='ignore')
+                content = decode_part_payload(part, payload)
                 
                 if content_type == 'text/plain':
                     text_content = content
-                elif content_type == 'text/html':
+                else:
                     html_content = content
+                
+                # Stop walking once both bodies are found
+                if text_content and html_content:
+                    break
         else:
             # Handle single part messages
             content_type = msg.get_content_type()
             payload = msg.get_payload(decode=True)
             
             if payload:
-                content = payload.decode('utf-8', errors='ignore')
+                content = decode_part_payload(msg, payload)
                 if content_type == 'text/html':
                     html_content = content
                 else:
                     text_content = content
         
         logger.info(
-            f"Parsed email content: text={len(text_content)} chars, html={len(html_content)} chars",
+            "Parsed email content: text=%s chars, html=%s chars", len(text_content), len(html_content),
             extra={"correlation_id": correlation_id}
         )
         
@@ -598,7 +1048,7 @@ def parse_email_content(raw_email: str, correlation_id: str) -> EmailContent:
         
     except Exception as e:
         logger.error(
-            f"Failed to parse email content: {str(e)}",
+            "Failed to parse email content: %s", e,
             extra={
                 "correlation_id": correlation_id,
                 "error_type": type(e).__name__
@@ -607,28 +1057,56 @@ def parse_email_content(raw_email: str, correlation_id: str) -> EmailContent:
         return EmailContent(text="", html="")
 
 
-async def send_webhook(payload: WebhookPayload, domain_config: DomainConfig, correlation_id: str) -> None:
-    """Send payload to webhook endpoint with retry logic using domain-specific configuration"""
+async def drain_response(response: httpx.Response, keep_bytes: int = 0) -> bytes:
+    """Consume a streamed response body, keeping at most its first keep_bytes"""
+    kept = bytearray()
+    drained = 0
+    async for chunk in response.aiter_bytes():
+        if len(kept) < keep_bytes:
+            kept += chunk[:keep_bytes - len(kept)]
+        drained += len(chunk)
+        # Past this point dropping the connection is cheaper than reading on
+        if drained > MAX_DRAIN_BYTES:
+            break
+    return bytes(kept)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header given as delay seconds or an HTTP date"""
+    if not value:
+        return None
+    
+    try:
+        delay = float(value)
+    except ValueError:
+        pass
+    else:
+        # float() also accepts 'nan', 'inf' and overflowing values like '1e400'
+        return max(delay, 0.0) if math.isfinite(delay) else None
+    
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
     
-    payload_dict = payload.to_dict()
-    payload_json = json.dumps(payload_dict, sort_keys=True)
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+async def send_webhook(payload: Union[WebhookPayload, WebhookBatchPayload], domain_config: DomainConfig, correlation_id: str) -> None:
+    """Send payload to webhook endpoint with retry logic using domain-specific configuration"""
     
-    headers = {
-        'Content-Type': 'application/json',
-        'User-Agent': 'AWS-SES-Lambda-Bridge/2.0',
-        'X-Correlation-ID': correlation_id
-    }
+    # orjson emits bytes directly; the same bytes are signed and sent on every attempt.
+    # The signature covers the exact body sent, so keys need no canonical sort.
+    payload_bytes = orjson.dumps(payload.to_dict())
     
-    # Add custom headers from domain configuration
-    headers.update(domain_config.custom_headers)
+    # One headers dict per send, reused unchanged by every attempt
+    headers = {**domain_config.base_headers, 'X-Correlation-ID': correlation_id}
     
     # Add HMAC signature if secret is configured
-    if domain_config.webhook_secret:
-        signature = hmac.new(
-            domain_config.webhook_secret.encode('utf-8'),
-            payload_json.encode('utf-8'),
-            hashlib.sha256
-        ).hexdigest()
+    if domain_config.webhook_secret_bytes:
+        signature = hmac.digest(domain_config.webhook_secret_bytes, payload_bytes, 'sha256').hex()
         headers['X-Webhook-Signature'] = f'sha256={signature}'
     
     # Get retry configuration
@@ -637,9 +1115,10 @@ async def send_webhook(payload: WebhookPayload, domain_config: DomainConfig, cor
     
     # Retry logic with exponential backoff
     for attempt in range(max_retries):
+        retry_after = None
         try:
             logger.info(
-                f"Sending webhook (attempt {attempt + 1}/{max_retries})",
+                "Sending webhook (attempt %s/%s)", attempt + 1, max_retries,
                 extra={
                     "correlation_id": correlation_id,
                     "webhook_url": domain_config.webhook_url,
@@ -648,48 +1127,67 @@ async def send_webhook(payload: WebhookPayload, domain_config: DomainConfig, cor
                 }
             )
             
-            async with httpx.AsyncClient(timeout=timeout_seconds) as client:
-                response = await client.post(
+            # Hold a slot only while the request is in flight, not while backing off
+            # Stream the response so ack bodies are never buffered
+            async with loop_semaphore('webhook', config.max_concurrent_webhooks):
+                async with http_client.stream(
+                    'POST',
                     domain_config.webhook_url,
-                    content=payload_json,
-                    headers=headers
-                )
+                    content=payload_bytes,
+                    headers=headers,
+                    timeout=timeout_seconds
+                ) as response:
+                    delivered = response.status_code in [200, 201, 202]
+                    response_prefix = await drain_response(response, keep_bytes=0 if delivered else 200)
             
-            if response.status_code in [200, 201, 202]:
+            if delivered:
+                # Ack size from the header, as the body itself is drained unread; None when
+                # the length is undeclared (chunked) or malformed, so a bad header can't fail a delivery
+                content_length = response.headers.get('content-length')
                 logger.info(
-                    f"Webhook delivered successfully with status {response.status_code}",
+                    "Webhook delivered successfully with status %s", response.status_code,
                     extra={
                         "correlation_id": correlation_id,
                         "status_code": response.status_code,
-                        "response_size": len(response.content),
+                        "response_size": int(content_length) if content_length and content_length.isdigit() else None,
                         "webhook_url": domain_config.webhook_url
                     }
                 )
                 return
             else:
                 logger.warning(
-                    f"Webhook returned status {response.status_code}",
+                    "Webhook returned status %s", response.status_code,
                     extra={
                         "correlation_id": correlation_id,
                         "status_code": response.status_code,
-                        "response_text": response.text[:200],
+                        "response_text": response_prefix.decode('utf-8', errors='replace'),
                         "webhook_url": domain_config.webhook_url
                     }
                 )
                 
+                # Client errors other than throttling won't succeed on retry
+                if 400 <= response.status_code < 500 and response.status_code != 429:
+                    error_msg = f"Webhook rejected with status {response.status_code} by {domain_config.webhook_url}"
+                    logger.error(error_msg, extra={"correlation_id": correlation_id})
+                    raise WebhookDeliveryError(error_msg)
+                
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                
+        except WebhookDeliveryError:
+            raise
         except httpx.TimeoutException as e:
             logger.error(
-                f"Webhook attempt {attempt + 1} timed out after {timeout_seconds}s: {str(e)}",
+                "Webhook attempt %s timed out after %ss: %s", attempt + 1, timeout_seconds, e,
                 extra={"correlation_id": correlation_id, "attempt": attempt + 1}
             )
         except httpx.RequestError as e:
             logger.error(
-                f"Webhook attempt {attempt + 1} failed: {str(e)}",
+                "Webhook attempt %s failed: %s", attempt + 1, e,
                 extra={"correlation_id": correlation_id, "attempt": attempt + 1}
             )
         except Exception as e:
             logger.error(
-                f"Unexpected error on attempt {attempt + 1}: {str(e)}",
+                "Unexpected error on attempt %s: %s", attempt + 1, e,
                 extra={
                     "correlation_id": correlation_id,
                     "attempt": attempt + 1,
@@ -697,11 +1195,21 @@ async def send_webhook(payload: WebhookPayload, domain_config: DomainConfig, cor
                 }
             )
         
-        # Wait before retry (exponential backoff with jitter)
+        # Wait before retry, honoring Retry-After over exponential backoff with full jitter
         if attempt < max_retries - 1:
-            wait_time = min(2 ** attempt + (time.time() % 1), 60)  # Add jitter, cap at 60s
+            if retry_after is not None:
+                if retry_after > MAX_RETRY_AFTER_SECONDS:
+                    error_msg = (
+                        f"Webhook asked to retry after {retry_after:.0f}s, beyond the "
+                        f"{MAX_RETRY_AFTER_SECONDS:.0f}s limit, at {domain_config.webhook_url}"
+                    )
+                    logger.error(error_msg, extra={"correlation_id": correlation_id})
+                    raise WebhookDeliveryError(error_msg)
+                wait_time = retry_after
+            else:
+                wait_time = random.uniform(0, min(MAX_BACKOFF_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
             logger.info(
-                f"Waiting {wait_time:.2f} seconds before retry",
+                "Waiting %.2f seconds before retry", wait_time,
                 extra={"correlation_id": correlation_id}
             )
             await asyncio.sleep(wait_time)
@@ -131,8 +131,10 @@ install_dependencies() {
     mkdir -p build
     
     # Install dependencies directly to build directory (root level)
-    print_info "Running: pip3 install -r $requirements_file -t build/ --no-cache-dir"
-    pip3 install -r "$requirements_file" -t build/ --no-cache-dir
+    # orjson ships compiled wheels, so pin the Lambda runtime platform
+    local platform_args="--platform manylinux2014_x86_64 --implementation cp --python-version 3.11 --only-binary=:all:"
+    print_info "Running: pip3 install -r $requirements_file -t build/ --no-cache-dir $platform_args"
+    pip3 install -r "$requirements_file" -t build/ --no-cache-dir $platform_args
     
     if [ $? -eq 0 ]; then
         print_success "Dependencies installed successfully"
@@ -171,7 +173,7 @@ validate_package() {
     cd "$build_dir"
     
     # Check for required files/directories
-    local required_items=("lambda_function.py" "httpx" "boto3" "botocore")
+    local required_items=("lambda_function.py" "httpx" "h2" "orjson" "boto3" "botocore")
     local missing_items=()
     
     for item in "${required_items[@]}"; do
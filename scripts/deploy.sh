@@ -45,7 +45,7 @@ mkdir package
 
 # Install dependencies directly to package directory
 echo "Installing Python dependencies..."
-pip3 install -r requirements.txt -t package/ --no-cache-dir
+pip3 install -r requirements.txt -t package/ --no-cache-dir --platform manylinux2014_x86_64 --implementation cp --python-version 3.11 --only-binary=:all:
 
 # Copy lambda function to package directory
 cp lambda_function.py package/
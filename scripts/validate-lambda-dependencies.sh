@@ -200,7 +200,7 @@ rebuild_package() {
     
     # Install dependencies with more verbose output
     echo "📦 Installing dependencies..."
-    pip3 install -r requirements.txt -t package/ --no-cache-dir --verbose
+    pip3 install -r requirements.txt -t package/ --no-cache-dir --verbose --platform manylinux2014_x86_64 --implementation cp --python-version 3.11 --only-binary=:all:
     
     # Verify httpx installation
     if [ -d "package/httpx" ]; then
@@ -63,6 +63,12 @@ variable "config_s3_key" {
   default     = "config/domains.json"
 }
 
+variable "lambda_memory_size" {
+  description = "Lambda memory in MB; 128 matches Lambda's default, 1769 MB is the first size that gets a full vCPU"
+  type        = number
+  default     = 128
+}
+
 variable "environment" {
   description = "Environment name (e.g., dev, staging, prod)"
   type        = string
@@ -244,6 +250,7 @@ resource "aws_lambda_function" "email_processor" {
   source_code_hash = filebase64sha256("lambda_function.zip")
   runtime         = "python3.11"
   timeout         = 60
+  memory_size     = var.lambda_memory_size
 
   environment {
     variables = merge({
@@ -9,10 +9,12 @@ import os
 import sys
 import tempfile
 import unittest
-from unittest.mock import Mock, patch, MagicMock
+from unittest.mock import Mock, patch, MagicMock, AsyncMock
 import asyncio
 from typing import Dict, Any
 
+import orjson
+
 # Add lambda directory to path to import our modules
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lambda', 'python'))
 
@@ -24,7 +26,7 @@ from lambda_function import (
 )
 
 
-class TestDomainConfigManager(unittest.TestCase):
+class TestDomainConfigManager(unittest.IsolatedAsyncioTestCase):
     """Test the DomainConfigManager class"""
     
     def setUp(self):
@@ -79,44 +81,36 @@ class TestDomainConfigManager(unittest.TestCase):
     def create_mock_s3_client(self):
         """Create a mock S3 client that returns our test config"""
         mock_s3_client = Mock()
+        config_bytes = orjson.dumps(self.test_config)
         mock_response = Mock()
-        mock_response.get.return_value = len(json.dumps(self.test_config))
+        mock_response.get.return_value = len(config_bytes)
         mock_body = Mock()
-        mock_body.read.return_value = json.dumps(self.test_config).encode('utf-8')
+        mock_body.read.return_value = config_bytes
         mock_response.__getitem__ = lambda self, key: mock_body if key == 'Body' else None
         mock_s3_client.get_object.return_value = mock_response
         return mock_s3_client
     
     @patch('lambda_function.boto3.client')
-    def test_load_config_from_s3(self, mock_boto3_client):
+    async def test_load_config_from_s3(self, mock_boto3_client):
         """Test loading configuration from S3"""
         mock_boto3_client.return_value = self.create_mock_s3_client()
         
         config_manager = DomainConfigManager(self.test_bucket, self.test_key)
         
-        # Test async function
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
-        config = loop.run_until_complete(config_manager.get_config())
+        config = await config_manager.get_config()
         
         self.assertEqual(config['version'], '1.0')
         self.assertEqual(len(config['domains']), 2)
         self.assertIn('example.com', config['domains'])
         self.assertIn('company.org', config['domains'])
-        
-        loop.close()
     
     @patch('lambda_function.boto3.client')
-    def test_get_domain_config_for_email(self, mock_boto3_client):
+    async def test_get_domain_config_for_email(self, mock_boto3_client):
         """Test getting domain configuration for specific emails"""
         mock_boto3_client.return_value = self.create_mock_s3_client()
         
         config_manager = DomainConfigManager(self.test_bucket, self.test_key)
         
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
         test_cases = [
             ("test@example.com", "example.com"),
             ("webhook@example.com", "example.com"),
@@ -127,9 +121,7 @@ class TestDomainConfigManager(unittest.TestCase):
         
         for email, expected_domain in test_cases:
             with self.subTest(email=email):
-                domain_config = loop.run_until_complete(
-                    config_manager.get_domain_config_for_email(email)
-                )
+                domain_config = await config_manager.get_domain_config_for_email(email)
                 
                 if expected_domain:
                     self.assertIsNotNone(domain_config)
@@ -139,19 +131,100 @@ class TestDomainConfigManager(unittest.TestCase):
                     )
                 else:
                     self.assertIsNone(domain_config)
-        
-        loop.close()
     
     @patch('lambda_function.boto3.client')
-    def test_email_filtering(self, mock_boto3_client):
+    async def test_pattern_precedence_follows_config_order(self, mock_boto3_client):
+        """Test that earlier wildcard and exact-address domains win over a later '*@domain' pattern"""
+        self.test_config['domains'] = {
+            "helpdesk": {
+                "webhook_url": "https://helpdesk.example.net/webhook",
+                "patterns": ["support@*", "Billing@Example.com"]
+            },
+            **self.test_config['domains']
+        }
+        mock_boto3_client.return_value = self.create_mock_s3_client()
+
+        config_manager = DomainConfigManager(self.test_bucket, self.test_key)
+
+        test_cases = [
+            ("support@example.com", "https://helpdesk.example.net/webhook"),
+            ("billing@example.com", "https://helpdesk.example.net/webhook"),
+            ("test@example.com", "https://api.example.com/webhook"),
+            ("example.com", None)
+        ]
+
+        for email, expected_webhook in test_cases:
+            with self.subTest(email=email):
+                domain_config = await config_manager.get_domain_config_for_email(email)
+
+                if expected_webhook:
+                    self.assertEqual(domain_config.webhook_url, expected_webhook)
+                else:
+                    self.assertIsNone(domain_config)
+
+    @patch('lambda_function.boto3.client')
+    async def test_resolution_is_cached_until_config_reload(self, mock_boto3_client):
+        """Test that repeated recipients reuse the resolved config until the config reloads"""
+        mock_boto3_client.return_value = self.create_mock_s3_client()
+
+        config_manager = DomainConfigManager(self.test_bucket, self.test_key)
+
+        first = await config_manager.get_domain_config_for_email("test@example.com")
+        again = await config_manager.get_domain_config_for_email("Test@Example.com")
+        self.assertIs(first, again)
+
+        # Expire the config cache so the next lookup reloads it
+        config_manager._cache_timestamp = 0
+        reloaded = await config_manager.get_domain_config_for_email("test@example.com")
+        self.assertIsNot(first, reloaded)
+        self.assertEqual(reloaded.webhook_url, first.webhook_url)
+
+    @patch('lambda_function.boto3.client')
+    async def test_concurrent_lookups_load_config_once(self, mock_boto3_client):
+        """Test that records resolved concurrently on a cold start share one S3 load"""
+        mock_s3_client = self.create_mock_s3_client()
+        mock_boto3_client.return_value = mock_s3_client
+
+        config_manager = DomainConfigManager(self.test_bucket, self.test_key)
+
+        results = await asyncio.gather(*(
+            config_manager.get_domain_config_for_email(email)
+            for email in ["test@example.com", "contact@company.org", "unknown@unknown.com"]
+        ))
+
+        self.assertEqual(mock_s3_client.get_object.call_count, 1)
+        self.assertEqual(results[1].webhook_url, "https://company.org/api/webhook")
+        self.assertIsNone(results[2])
+
+    @patch('lambda_function.boto3.client')
+    async def test_unchanged_config_is_not_reparsed(self, mock_boto3_client):
+        """Test that a 304 on refresh keeps the cached config and resolved recipients"""
+        from botocore.exceptions import ClientError
+
+        mock_s3_client = self.create_mock_s3_client()
+        mock_s3_client.get_object.side_effect = [
+            mock_s3_client.get_object.return_value,
+            ClientError({'Error': {'Code': '304', 'Message': 'Not Modified'}}, 'GetObject')
+        ]
+        mock_boto3_client.return_value = mock_s3_client
+
+        config_manager = DomainConfigManager(self.test_bucket, self.test_key)
+
+        first = await config_manager.get_domain_config_for_email("test@example.com")
+        config_manager._cache_timestamp = 0
+        again = await config_manager.get_domain_config_for_email("test@example.com")
+
+        self.assertIs(first, again)
+        self.assertIn('IfNoneMatch', mock_s3_client.get_object.call_args.kwargs)
+        self.assertTrue(config_manager._is_cache_valid())
+
+    @patch('lambda_function.boto3.client')
+    async def test_email_filtering(self, mock_boto3_client):
         """Test email filtering logic"""
         mock_boto3_client.return_value = self.create_mock_s3_client()
         
         config_manager = DomainConfigManager(self.test_bucket, self.test_key)
         
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
         # Test cases: (from_email, to_email, should_pass)
         test_cases = [
             # example.com domain (allows all senders)
@@ -176,20 +249,16 @@ class TestDomainConfigManager(unittest.TestCase):
                     correlation_id="test-correlation-id"
                 )
                 
-                domain_config = loop.run_until_complete(
-                    config_manager.is_email_allowed(metadata)
-                )
+                domain_config = await config_manager.is_email_allowed(metadata)
                 
                 if should_pass:
                     self.assertIsNotNone(domain_config, f"Expected {from_email} -> {to_email} to be allowed")
                 else:
                     self.assertIsNone(domain_config, f"Expected {from_email} -> {to_email} to be blocked")
-        
-        loop.close()
     
     @patch('os.environ')
     @patch('lambda_function.boto3.client')
-    def test_fallback_to_env_config(self, mock_boto3_client, mock_environ):
+    async def test_fallback_to_env_config(self, mock_boto3_client, mock_environ):
         """Test fallback to environment variables when S3 config is not available"""
         # Mock S3 client to return NoSuchKey exception
         mock_s3_client = Mock()
@@ -209,18 +278,13 @@ class TestDomainConfigManager(unittest.TestCase):
         
         config_manager = DomainConfigManager(self.test_bucket, self.test_key)
         
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
-        config = loop.run_until_complete(config_manager.get_config())
+        config = await config_manager.get_config()
         
         self.assertIn('env-domain.com', config['domains'])
         self.assertEqual(
             config['domains']['env-domain.com']['webhook_url'],
             'https://env-webhook.com/hook'
         )
-        
-        loop.close()
 
 
 class TestEmailProcessingIntegration(unittest.TestCase):
@@ -285,7 +349,7 @@ class TestEmailProcessingIntegration(unittest.TestCase):
                     retry_config={"max_retries": 3, "timeout_seconds": 30}
                 )
                 
-                mock_config_manager.is_email_allowed.return_value = mock_domain_config
+                mock_config_manager.find_domain_config = AsyncMock(return_value=mock_domain_config)
                 
                 # Create SES event
                 ses_event = self.create_ses_event_data(from_email, [to_email])
@@ -301,9 +365,373 @@ class TestEmailProcessingIntegration(unittest.TestCase):
                 domain_config_arg = call_args[0][1]  # Second argument is domain_config
                 
                 self.assertEqual(domain_config_arg.webhook_url, expected_webhook)
-        
+
         loop.close()
 
+    @patch('lambda_function.domain_config_manager')
+    @patch('lambda_function.get_email_content')
+    @patch('lambda_function.send_webhook')
+    def test_body_is_not_fetched_when_disabled(self, mock_send_webhook, mock_get_email_content, mock_config_manager):
+        """Test that WEBHOOK_INCLUDE_BODY=false sends metadata without reading the email from S3"""
+        from lambda_function import config
+
+        mock_config_manager.find_domain_config = AsyncMock(return_value=DomainConfig(
+            webhook_url="https://api.example.com/webhook",
+            webhook_secret="test-secret",
+            patterns=["*@example.com"],
+            filters={}
+        ))
+
+        with patch.object(config, 'include_email_body', False):
+            asyncio.run(process_ses_email(
+                self.create_ses_event_data("sender@external.com", ["test@example.com"]),
+                "test-correlation-id"
+            ))
+
+        mock_get_email_content.assert_not_called()
+        payload = mock_send_webhook.call_args[0][0]
+        self.assertEqual(payload.metadata.subject, "Test Email Subject")
+        self.assertEqual((payload.content.text, payload.content.html), ("", ""))
+
+    @patch('lambda_function.domain_config_manager')
+    @patch('lambda_function.process_ses_email')
+    def test_lambda_handler_partial_batch_failure(self, mock_process_ses_email, mock_config_manager):
+        """Test that one failing record does not fail the whole batch"""
+        from lambda_function import lambda_handler, EmailProcessingError
+
+        async def process(ses_data, correlation_id):
+            if ses_data['mail']['messageId'] == 'bad-message-id':
+                raise EmailProcessingError("boom")
+
+        mock_process_ses_email.side_effect = process
+
+        event = {
+            "Records": [
+                {"eventSource": "aws:ses", "ses": self.create_ses_event_data("a@x.com", ["test@example.com"], "good-message-id")},
+                {"eventSource": "aws:ses", "ses": self.create_ses_event_data("b@x.com", ["test@example.com"], "bad-message-id")}
+            ]
+        }
+
+        response = lambda_handler(event, None)
+        body = json.loads(response['body'])
+
+        self.assertEqual(response['statusCode'], 207)
+        self.assertEqual(body['failed_message_ids'], ['bad-message-id'])
+        self.assertEqual(mock_process_ses_email.call_count, 2)
+
+    @patch('lambda_function.send_webhook')
+    @patch('lambda_function.prepare_ses_email')
+    def test_records_for_one_webhook_are_batched(self, mock_prepare_ses_email, mock_send_webhook):
+        """Test that records sharing a webhook go out in one request when batching is enabled"""
+        from lambda_function import (
+            config, process_ses_records, EmailContent, WebhookBatchPayload, WebhookDeliveryError
+        )
+
+        def domain_config(url):
+            return DomainConfig(webhook_url=url, webhook_secret="secret", patterns=[], filters={})
+
+        shared_config = domain_config("https://api.example.com/webhook")
+        other_config = domain_config("https://other.example.com/webhook")
+
+        async def prepare(ses_data, correlation_id):
+            message_id = ses_data['mail']['messageId']
+            if message_id == 'filtered-message-id':
+                return None
+            target = other_config if message_id == 'other-message-id' else shared_config
+            return Mock(name=message_id), target
+
+        async def send(payload, domain_config, correlation_id):
+            if domain_config is other_config:
+                raise WebhookDeliveryError("rejected")
+
+        mock_prepare_ses_email.side_effect = prepare
+        mock_send_webhook.side_effect = send
+
+        records = [
+            self.create_ses_event_data("a@x.com", ["test@example.com"], message_id)
+            for message_id in ["first-message-id", "filtered-message-id", "second-message-id", "other-message-id"]
+        ]
+
+        with patch.object(config, 'batch_webhooks', True):
+            results = asyncio.run(process_ses_records(records, "test-correlation-id"))
+
+        self.assertEqual(mock_send_webhook.call_count, 2)
+        batch = next(
+            call.args[0] for call in mock_send_webhook.call_args_list
+            if call.args[1] is shared_config
+        )
+        self.assertIsInstance(batch, WebhookBatchPayload)
+        self.assertEqual(len(batch.events), 2)
+        self.assertEqual(results[:3], [None, None, None])
+        self.assertIsInstance(results[3], Exception)
+
+    @patch('lambda_function.send_webhook')
+    @patch('lambda_function.prepare_ses_email')
+    def test_batches_keep_per_domain_headers(self, mock_prepare_ses_email, mock_send_webhook):
+        """Test that configs sharing a webhook URL but not custom headers are batched separately"""
+        from lambda_function import config, process_ses_records
+
+        def domain_config(tenant):
+            return DomainConfig(
+                webhook_url="https://api.example.com/webhook",
+                webhook_secret="secret",
+                patterns=[],
+                filters={},
+                custom_headers={"X-Tenant": tenant}
+            )
+
+        # Separate config objects with equal settings, as two recipients of one domain get
+        configs = {
+            "first-message-id": domain_config("alpha"),
+            "second-message-id": domain_config("alpha"),
+            "third-message-id": domain_config("beta")
+        }
+        payloads = {message_id: Mock() for message_id in configs}
+
+        async def prepare(ses_data, correlation_id):
+            message_id = ses_data['mail']['messageId']
+            return payloads[message_id], configs[message_id]
+
+        mock_prepare_ses_email.side_effect = prepare
+
+        records = [
+            self.create_ses_event_data("a@x.com", ["test@example.com"], message_id)
+            for message_id in configs
+        ]
+
+        with patch.object(config, 'batch_webhooks', True):
+            asyncio.run(process_ses_records(records, "test-correlation-id"))
+
+        self.assertEqual(mock_send_webhook.call_count, 2)
+        sent = {
+            call.args[1].base_headers["X-Tenant"]: call.args[0]
+            for call in mock_send_webhook.call_args_list
+        }
+        self.assertEqual(len(sent["alpha"].events), 2)
+        self.assertIs(sent["beta"], payloads["third-message-id"])
+
+
+class TestEmailParsing(unittest.TestCase):
+    """Test MIME body extraction"""
+    
+    def test_skips_attachment_subtrees(self):
+        """Test that attached messages are not mistaken for the email body"""
+        from email.parser import BytesParser
+        from email.policy import compat32
+        from lambda_function import parse_email_message
+        
+        raw_email = (
+            b'Content-Type: multipart/mixed; boundary="mixed"\r\n\r\n'
+            b'--mixed\r\n'
+            b'Content-Type: message/rfc822\r\n'
+            b'Content-Disposition: attachment\r\n\r\n'
+            b'Content-Type: text/plain\r\n\r\nforwarded body\r\n'
+            b'--mixed\r\n'
+            b'Content-Type: text/plain; charset=iso-8859-1\r\n'
+            b'Content-Transfer-Encoding: quoted-printable\r\n\r\n'
+            b'caf=E9\r\n'
+            b'--mixed--\r\n'
+        )
+        
+        content = parse_email_message(
+            BytesParser(policy=compat32).parsebytes(raw_email),
+            "test-correlation-id"
+        )
+        
+        self.assertEqual(content.text.strip(), "caf\u00e9")
+        self.assertEqual(content.html, "")
+
+    def test_first_text_and_html_bodies_win(self):
+        """Test that later body parts are ignored and unknown charsets fall back to UTF-8"""
+        from email.parser import BytesParser
+        from email.policy import compat32
+        from lambda_function import parse_email_message
+
+        raw_email = (
+            b'Content-Type: multipart/alternative; boundary="alt"\r\n\r\n'
+            b'--alt\r\n'
+            b'Content-Type: text/plain; charset=x-unknown\r\n\r\n'
+            b'first \xc3\xa9\r\n'
+            b'--alt\r\n'
+            b'Content-Type: text/html\r\n\r\n'
+            b'<p>first</p>\r\n'
+            b'--alt\r\n'
+            b'Content-Type: text/plain\r\n\r\n'
+            b'second\r\n'
+            b'--alt--\r\n'
+        )
+
+        content = parse_email_message(
+            BytesParser(policy=compat32).parsebytes(raw_email),
+            "test-correlation-id"
+        )
+
+        self.assertEqual(content.text.strip(), "first \u00e9")
+        self.assertEqual(content.html.strip(), "<p>first</p>")
+
+
+class TestGetEmailContent(unittest.TestCase):
+    """Test retrieving stored emails from S3"""
+
+    def test_oversized_email_is_rejected_before_download(self):
+        """Test that the first ranged GET's object size rejects a large email unread"""
+        from lambda_function import get_email_content
+
+        mock_body = Mock()
+        mock_s3_client = Mock()
+        mock_s3_client.get_object.return_value = {
+            'Body': mock_body,
+            'ContentRange': f"bytes 0-1048575/{20 * 1024 * 1024}"
+        }
+        ses_data = {
+            'mail': {'messageId': 'test-message-id'},
+            'receipt': {'action': {'type': 's3', 'bucketName': 'emails', 'objectKey': 'test-message-id'}}
+        }
+
+        with patch('lambda_function.s3_client', mock_s3_client):
+            content = asyncio.run(get_email_content(ses_data, "test-correlation-id", max_size_mb=10))
+
+        self.assertEqual(content.text, "Email too large to process")
+        self.assertEqual(mock_s3_client.get_object.call_count, 1)
+        self.assertIn('Range', mock_s3_client.get_object.call_args.kwargs)
+        mock_body.read.assert_not_called()
+        mock_body.close.assert_called_once()
+
+
+class TestSendWebhook(unittest.TestCase):
+    """Test webhook delivery and retry behaviour"""
+    
+    def setUp(self):
+        from lambda_function import WebhookPayload, EmailContent
+        
+        self.domain_config = DomainConfig(
+            webhook_url="https://api.example.com/webhook",
+            webhook_secret="test-secret",
+            patterns=["*@example.com"],
+            filters={},
+            retry_config={"max_retries": 3, "timeout_seconds": 30}
+        )
+        self.payload = WebhookPayload(
+            event_type="email_received",
+            metadata=EmailMetadata(
+                message_id="test-message-id",
+                timestamp="2024-01-15T10:00:00Z",
+                from_address="sender@external.com",
+                to_addresses=["test@example.com"],
+                subject="Test Subject",
+                correlation_id="test-correlation-id"
+            ),
+            content=EmailContent(text="Test email content", html="")
+        )
+    
+    def send_with_responses(self, responses):
+        """Send the test payload against a transport replaying the given responses
+        
+        Returns the captured requests, the patched sleep and the error raised (or None).
+        """
+        import httpx
+        from lambda_function import send_webhook
+        
+        requests = []
+        
+        def handler(request):
+            requests.append(request)
+            return responses[len(requests) - 1]
+        
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        with patch('lambda_function.http_client', client), \
+                patch('lambda_function.asyncio.sleep') as mock_sleep:
+            async def run():
+                try:
+                    await send_webhook(self.payload, self.domain_config, "test-correlation-id")
+                except Exception as e:
+                    return e
+                finally:
+                    await client.aclose()
+            
+            error = asyncio.run(run())
+        
+        return requests, mock_sleep, error
+    
+    def test_permanent_client_error_is_not_retried(self):
+        """Test that a 4xx response fails without further attempts"""
+        import httpx
+        from lambda_function import WebhookDeliveryError
+        
+        requests, mock_sleep, error = self.send_with_responses([httpx.Response(400)] * 3)
+        
+        self.assertIsInstance(error, WebhookDeliveryError)
+        self.assertEqual(len(requests), 1)
+        mock_sleep.assert_not_called()
+    
+    def test_throttled_request_is_retried(self):
+        """Test that a 429 is retried rather than treated as a permanent 4xx"""
+        import httpx
+        
+        requests, mock_sleep, error = self.send_with_responses([httpx.Response(429), httpx.Response(200)])
+        
+        self.assertIsNone(error)
+        self.assertEqual(len(requests), 2)
+        mock_sleep.assert_called_once()
+    
+    def test_retry_after_is_honored(self):
+        """Test that Retry-After replaces the default backoff"""
+        import httpx
+        
+        requests, mock_sleep, error = self.send_with_responses([
+            httpx.Response(429, headers={"Retry-After": "2"}),
+            httpx.Response(200)
+        ])
+        
+        self.assertIsNone(error)
+        self.assertEqual(len(requests), 2)
+        mock_sleep.assert_called_once_with(2.0)
+    
+    def test_non_finite_retry_after_falls_back_to_backoff(self):
+        """Test that a 'nan' or 'inf' Retry-After is ignored in favor of jittered backoff"""
+        import math
+        import httpx
+        from lambda_function import BACKOFF_BASE_SECONDS
+        
+        for value in ["nan", "inf", "1e400"]:
+            with self.subTest(retry_after=value):
+                requests, mock_sleep, error = self.send_with_responses([
+                    httpx.Response(429, headers={"Retry-After": value}),
+                    httpx.Response(200)
+                ])
+                
+                self.assertIsNone(error)
+                self.assertEqual(len(requests), 2)
+                wait_time = mock_sleep.call_args.args[0]
+                self.assertTrue(math.isfinite(wait_time))
+                self.assertLessEqual(wait_time, BACKOFF_BASE_SECONDS)
+    
+    def test_retry_after_beyond_limit_fails_without_waiting(self):
+        """Test that a Retry-After longer than the time budget fails the record instead of sleeping"""
+        import httpx
+        from lambda_function import MAX_RETRY_AFTER_SECONDS, WebhookDeliveryError
+        
+        requests, mock_sleep, error = self.send_with_responses([
+            httpx.Response(503, headers={"Retry-After": str(int(MAX_RETRY_AFTER_SECONDS) + 40)}),
+            httpx.Response(200)
+        ])
+        
+        self.assertIsInstance(error, WebhookDeliveryError)
+        self.assertEqual(len(requests), 1)
+        mock_sleep.assert_not_called()
+
+    def test_signature_matches_hmac_of_sent_body(self):
+        """Test that the signature header is the HMAC-SHA256 of the exact body sent"""
+        import hashlib
+        import hmac
+        import httpx
+
+        requests, _, error = self.send_with_responses([httpx.Response(200)])
+        self.assertIsNone(error)
+
+        expected = hmac.new(b"test-secret", requests[0].content, hashlib.sha256).hexdigest()
+        self.assertEqual(requests[0].headers["X-Webhook-Signature"], f"sha256={expected}")
+
 
 def run_config_validation_test():
     """Test the configuration validation script"""
@@ -8,130 +8,259 @@ import json
 import hmac
 import hashlib
 import os
-from http.server import HTTPServer, BaseHTTPRequestHandler
+import signal
+import socket
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 from urllib.parse import urlparse
 import argparse
-import datetime
+import sys
+import time
+
+# orjson is optional; both raise ValueError subclasses. orjson parses the
+# body buffer in place, while the stdlib parser needs a bytes copy of it.
+try:
+    import orjson
+    
+    json_loads = orjson.loads
+    
+    def json_pretty(data):
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2).decode('utf-8')
+except ImportError:
+    def json_loads(data):
+        return json.loads(bytes(data))
+    
+    def json_pretty(data):
+        return json.dumps(data, indent=2)
+
+# Rules framing each printed webhook
+SEPARATOR = '=' * 80
+RULE = '─' * 40
+
+# Headers worth echoing from the payload, matched case-insensitively
+DISPLAYED_HEADERS = frozenset({'date', 'return-path', 'message-id', 'content-type'})
+
+# Prefix of the X-Webhook-Signature header sent by the Lambda
+SIGNATURE_PREFIX = 'sha256='
+
+# Largest request body accepted; the Lambda's default email limit is 10 MB
+MAX_BODY_BYTES = 64 * 1024 * 1024
+
+# Initial size of each connection's request body buffer
+BODY_BUFFER_SIZE = 65536
+
+# Every accepted webhook gets the same response, so the whole HTTP/1.1
+# reply is assembled once; Content-Length delimits it on a kept-alive connection
+SUCCESS_BODY = json.dumps({'status': 'success', 'message': 'Email processed'}).encode('utf-8')
+SUCCESS_RESPONSE = (
+    b'HTTP/1.1 200 OK\r\n'
+    b'Content-Type: application/json\r\n'
+    b'Content-Length: ' + str(len(SUCCESS_BODY)).encode('ascii') + b'\r\n'
+    b'\r\n' + SUCCESS_BODY
+)
+
+# Last formatted second as (epoch second, text); replaced as a whole so threads never see a torn pair
+_timestamp_cache = (0, '')
+
+def current_timestamp() -> str:
+    """Local time to the second, formatted at most once per second"""
+    global _timestamp_cache
+    now = int(time.time())
+    cached_second, formatted = _timestamp_cache
+    if now != cached_second:
+        formatted = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(now))
+        _timestamp_cache = (now, formatted)
+    return formatted
 
 class WebhookHandler(BaseHTTPRequestHandler):
+    # Keep connections open so the Lambda's pooled client doesn't reconnect per webhook
+    protocol_version = 'HTTP/1.1'
+    
+    # TCP_NODELAY on each connection so small replies aren't held back by Nagle
+    disable_nagle_algorithm = True
+    
+    # Keyed once in main(); each request copies it instead of re-deriving the HMAC pads
+    webhook_hmac = None
+    
+    # Set once in main() from --debug or DEBUG
+    debug = False
+    
+    def setup(self):
+        """Allocate a body buffer reused by every request on this connection"""
+        super().setup()
+        self.body_buffer = bytearray(BODY_BUFFER_SIZE)
+    
     def do_POST(self):
         """Handle incoming webhook POST requests"""
         try:
-            # Get content length
-            content_length = int(self.headers.get('Content-Length', 0))
-            
-            # Read the request body
-            post_data = self.rfile.read(content_length)
+            post_data = self.read_body()
+            if post_data is None:
+                return
             
-            # Parse JSON payload
-            try:
-                payload = json.loads(post_data.decode('utf-8'))
-            except json.JSONDecodeError as e:
-                self.send_error(400, f"Invalid JSON: {str(e)}")
+            # Authenticate before parsing so unsigned bodies are never decoded
+            if not self.authenticate(post_data):
                 return
             
-            # Verify webhook signature if secret is provided
-            webhook_secret = os.environ.get('WEBHOOK_SECRET')
-            if webhook_secret:
-                signature_header = self.headers.get('X-Webhook-Signature', '')
-                if not self.verify_signature(post_data, signature_header, webhook_secret):
-                    self.send_error(401, "Invalid signature")
-                    return
-                print("✅ Signature verification passed")
+            payload = self.parse_payload(post_data)
+            if payload is None:
+                return
             
             # Process the webhook payload
             self.process_email_webhook(payload)
-            
-            # Send success response
-            self.send_response(200)
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            
-            response = {'status': 'success', 'message': 'Email processed'}
-            self.wfile.write(json.dumps(response).encode('utf-8'))
+            self.send_success()
             
         except Exception as e:
+            # Last resort so a bug in the receiver still answers the request
             print(f"❌ Error processing webhook: {str(e)}")
             self.send_error(500, str(e))
     
-    def verify_signature(self, payload: bytes, signature_header: str, secret: str) -> bool:
+    def read_body(self):
+        """Read the request body into the connection's buffer; None once an error is sent"""
+        try:
+            content_length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            content_length = -1
+        if content_length < 0:
+            self.send_error(400, "Invalid Content-Length")
+            return None
+        
+        # Rejected before reading; send_error closes the connection so the unread body is dropped
+        if content_length > MAX_BODY_BYTES:
+            self.send_error(413, f"Payload exceeds {MAX_BODY_BYTES} bytes")
+            return None
+        
+        # Grow the buffer for bodies larger than any seen on this connection
+        if content_length > len(self.body_buffer):
+            self.body_buffer = bytearray(content_length)
+        body_view = memoryview(self.body_buffer)
+        return body_view[:self.rfile.readinto(body_view[:content_length])]
+    
+    def authenticate(self, post_data) -> bool:
+        """Verify the webhook signature if a secret is configured, sending 401 on mismatch"""
+        if self.webhook_hmac is None:
+            return True
+        
+        signature_header = self.headers.get('X-Webhook-Signature', '')
+        if not self.verify_signature(post_data, signature_header, self.webhook_hmac):
+            self.send_error(401, "Invalid signature")
+            return False
+        
+        print("✅ Signature verification passed")
+        return True
+    
+    def parse_payload(self, post_data):
+        """Parse the JSON payload object; None once an error is sent"""
+        # ValueError covers JSONDecodeError from either parser and the stdlib's
+        # UnicodeDecodeError on bodies that aren't valid UTF-8
+        try:
+            payload = json_loads(post_data)
+        except ValueError as e:
+            self.send_error(400, f"Invalid JSON: {str(e)}")
+            return None
+        
+        if not isinstance(payload, dict):
+            self.send_error(400, "Payload must be a JSON object")
+            return None
+        return payload
+    
+    def send_success(self):
+        """Send the prebuilt success response in a single write"""
+        # send_response() would have logged the request
+        self.log_request(200)
+        self.wfile.write(SUCCESS_RESPONSE)
+    
+    def verify_signature(self, payload: bytes, signature_header: str, keyed_hmac: hmac.HMAC) -> bool:
         """Verify webhook signature"""
-        if not signature_header.startswith('sha256='):
+        if not signature_header.startswith(SIGNATURE_PREFIX):
             return False
         
-        received_signature = signature_header[7:]  # Remove 'sha256=' prefix
+        # Compare raw digests rather than hex strings; fromhex reads the str directly
+        try:
+            received_signature = bytes.fromhex(signature_header[len(SIGNATURE_PREFIX):])
+        except ValueError:
+            return False
         
-        # Calculate expected signature
-        expected_signature = hmac.new(
-            secret.encode('utf-8'),
-            payload,
-            hashlib.sha256
-        ).hexdigest()
+        # Calculate expected signature from a copy of the keyed state
+        signer = keyed_hmac.copy()
+        signer.update(payload)
+        expected_signature = signer.digest()
         
         return hmac.compare_digest(received_signature, expected_signature)
     
     def process_email_webhook(self, payload: dict):
         """Process and display the email webhook payload"""
-        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        timestamp = current_timestamp()
         
-        print(f"\n{'='*80}")
-        print(f"🔔 EMAIL WEBHOOK RECEIVED at {timestamp}")
-        print(f"{'='*80}")
+        # Collected and written once, so output from concurrent requests doesn't interleave
+        lines = []
+        
+        lines.append(f"\n{SEPARATOR}")
+        lines.append(f"🔔 EMAIL WEBHOOK RECEIVED at {timestamp}")
+        lines.append(SEPARATOR)
         
         # Basic email info
-        print(f"📧 Message ID: {payload.get('message_id', 'N/A')}")
-        print(f"📅 Timestamp: {payload.get('timestamp', 'N/A')}")
-        print(f"👤 From: {payload.get('source', 'N/A')}")
-        print(f"📨 To: {', '.join(payload.get('destination', []))}")
-        print(f"📋 Subject: {payload.get('subject', 'N/A')}")
+        lines.append(f"📧 Message ID: {payload.get('message_id', 'N/A')}")
+        lines.append(f"📅 Timestamp: {payload.get('timestamp', 'N/A')}")
+        lines.append(f"👤 From: {payload.get('source', 'N/A')}")
+        lines.append(f"📨 To: {', '.join(payload.get('destination', []))}")
+        lines.append(f"📋 Subject: {payload.get('subject', 'N/A')}")
         
         # Email content
         email_data = payload.get('email', {})
         if email_data:
-            print(f"\n📄 EMAIL CONTENT:")
-            print(f"{'─'*40}")
+            lines.append(f"\n📄 EMAIL CONTENT:")
+            lines.append(RULE)
             
             text_content = email_data.get('text_content', '').strip()
             html_content = email_data.get('html_content', '').strip()
             attachments = email_data.get('attachments', [])
             
             if text_content:
-                print(f"📝 Text Content ({len(text_content)} chars):")
-                print(f"   {text_content[:200]}{'...' if len(text_content) > 200 else ''}")
+                lines.append(f"📝 Text Content ({len(text_content)} chars):")
+                lines.append(f"   {text_content[:200]}{'...' if len(text_content) > 200 else ''}")
             
             if html_content:
-                print(f"🌐 HTML Content ({len(html_content)} chars):")
-                print(f"   {html_content[:200]}{'...' if len(html_content) > 200 else ''}")
+                lines.append(f"🌐 HTML Content ({len(html_content)} chars):")
+                lines.append(f"   {html_content[:200]}{'...' if len(html_content) > 200 else ''}")
             
             if attachments:
-                print(f"📎 Attachments ({len(attachments)}):")
+                lines.append(f"📎 Attachments ({len(attachments)}):")
                 for i, attachment in enumerate(attachments, 1):
-                    print(f"   {i}. {attachment.get('filename', 'unnamed')} "
-                          f"({attachment.get('content_type', 'unknown')} - "
-                          f"{attachment.get('size', 0)} bytes)")
+                    lines.append(f"   {i}. {attachment.get('filename', 'unnamed')} "
+                                 f"({attachment.get('content_type', 'unknown')} - "
+                                 f"{attachment.get('size', 0)} bytes)")
         
         # Headers
         headers = payload.get('headers', {})
         if headers:
-            print(f"\n📋 HEADERS:")
-            print(f"{'─'*40}")
-            for key, value in headers.items():
-                if key.lower() in ['date', 'return-path', 'message-id', 'content-type']:
-                    print(f"   {key}: {value}")
+            lines.append(f"\n📋 HEADERS:")
+            lines.append(RULE)
+            lines.extend(
+                f"   {key}: {value}" for key, value in headers.items()
+                if key.lower() in DISPLAYED_HEADERS
+            )
         
         # Raw payload (for debugging)
-        if os.environ.get('DEBUG', '').lower() == 'true':
-            print(f"\n🔍 RAW PAYLOAD:")
-            print(f"{'─'*40}")
-            print(json.dumps(payload, indent=2))
+        if self.debug:
+            lines.append(f"\n🔍 RAW PAYLOAD:")
+            lines.append(RULE)
+            lines.append(json_pretty(payload))
+        
+        lines.append(f"{SEPARATOR}\n")
         
-        print(f"{'='*80}\n")
+        sys.stdout.write('\n'.join(lines) + '\n')
+        sys.stdout.flush()
     
     def log_message(self, format, *args):
         """Override to customize log format"""
-        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        timestamp = current_timestamp()
         print(f"[{timestamp}] {format % args}")
 
+class ReusePortHTTPServer(ThreadingHTTPServer):
+    """Threaded server whose port can be shared by several worker processes"""
+    def server_bind(self):
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
 def main():
     parser = argparse.ArgumentParser(
         description="Test webhook receiver for AWS SES + Lambda email bridge"
@@ -156,30 +285,72 @@ def main():
         action='store_true',
         help='Enable debug mode (shows full payload)'
     )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=1,
+        help='Worker processes sharing the port (default: 1)'
+    )
     
     args = parser.parse_args()
+    if args.workers < 1:
+        parser.error('--workers must be at least 1')
+    if args.workers > 1 and not hasattr(socket, 'SO_REUSEPORT'):
+        parser.error('--workers requires SO_REUSEPORT support')
     
     # Set environment variables
     if args.secret:
         os.environ['WEBHOOK_SECRET'] = args.secret
     if args.debug:
         os.environ['DEBUG'] = 'true'
+    webhook_secret = os.environ.get('WEBHOOK_SECRET')
+    if webhook_secret:
+        WebhookHandler.webhook_hmac = hmac.new(webhook_secret.encode('utf-8'), digestmod=hashlib.sha256)
+    WebhookHandler.debug = os.environ.get('DEBUG', '').lower() == 'true'
+    
+    # Fork extra workers before binding; with SO_REUSEPORT the kernel
+    # spreads incoming connections across every process on the port
+    worker_pids = []
+    is_worker = False
+    for _ in range(args.workers - 1):
+        pid = os.fork()
+        if pid == 0:
+            worker_pids = []
+            is_worker = True
+            break
+        worker_pids.append(pid)
     
-    # Start the server
+    # Start the server; each connection gets its own thread so concurrent
+    # webhooks from one Lambda invocation are not serialized
     server_address = (args.host, args.port)
-    httpd = HTTPServer(server_address, WebhookHandler)
+    server_class = ReusePortHTTPServer if args.workers > 1 else ThreadingHTTPServer
+    httpd = server_class(server_address, WebhookHandler)
     
-    print(f"🚀 Starting webhook receiver...")
-    print(f"🌐 Listening on http://{args.host}:{args.port}")
-    print(f"🔑 Signature verification: {'enabled' if args.secret else 'disabled'}")
-    print(f"🔍 Debug mode: {'enabled' if args.debug else 'disabled'}")
-    print(f"⏹️  Press Ctrl+C to stop\n")
+    if not is_worker:
+        print(f"🚀 Starting webhook receiver...")
+        print(f"🌐 Listening on http://{args.host}:{args.port}")
+        print(f"🔑 Signature verification: {'enabled' if args.secret else 'disabled'}")
+        print(f"🔍 Debug mode: {'enabled' if args.debug else 'disabled'}")
+        print(f"👷 Worker processes: {args.workers}")
+        print(f"⏹️  Press Ctrl+C to stop\n")
     
+    # Block in select() until a connection arrives instead of waking every
+    # 0.5s; nothing calls shutdown(), Ctrl+C interrupts the wait directly
     try:
-        httpd.serve_forever()
+        httpd.serve_forever(poll_interval=None)
     except KeyboardInterrupt:
-        print("\n👋 Shutting down webhook receiver...")
-        httpd.shutdown()
+        if not is_worker:
+            print("\n👋 Shutting down webhook receiver...")
+        httpd.server_close()
+        
+        # Ctrl+C reaches the whole process group, but a signal sent to the
+        # parent alone must still stop its workers
+        for pid in worker_pids:
+            try:
+                os.kill(pid, signal.SIGINT)
+            except ProcessLookupError:
+                pass
+            os.waitpid(pid, 0)
 
 if __name__ == '__main__':
     main() 
\ No newline at end of file